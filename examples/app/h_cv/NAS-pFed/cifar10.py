@@ -160,6 +160,18 @@ def add_args(parser):
     parser.add_argument(
         "--arch", type=str, default="FedNAS_V1", help="which architecture to use"
     )
+    parser.add_argument(
+        "--amp",
+        action="store_true",
+        default=False,
+        help="run the search model under bf16 autocast on CUDA",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        default=False,
+        help="run the search model's training forward through torch.compile",
+    )
 
     args = parser.parse_args()
     return args
@@ -22,7 +22,9 @@ import torch.nn.functional as F
 
 
 def _concat(xs):
-    return torch.cat([x.view(-1) for x in xs])
+    # reshape rather than view: channels_last conv weights, their grads and
+    # momentum buffers are not contiguous
+    return torch.cat([x.reshape(-1) for x in xs])
 
 
 class Architect(object):
@@ -44,6 +46,7 @@ class Architect(object):
         )
 
         self.device = device
+        self.is_multi_gpu = False
 
     # Momentum: https://blog.paperspace.com/intro-to-optimization-momentum-rmsprop-adam/
     # V_j = coefficient_momentum * V_j - learning_rate * gradient
@@ -13,16 +13,32 @@
 # limitations under the License.
 
 import logging
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 import numpy as np
 import torch
 from torch.autograd import Variable
 import torch.nn.functional as F
 
+Genotype = namedtuple("Genotype", "normal normal_concat reduce reduce_concat")
+
+# candidate operations of every MixedOp edge, in the order of the alpha columns
+PRIMITIVES = [
+    "none",
+    "max_pool_3x3",
+    "avg_pool_3x3",
+    "skip_connect",
+    "sep_conv_3x3",
+    "sep_conv_5x5",
+    "dil_conv_3x3",
+    "dil_conv_5x5",
+]
+
 
 def _concat(xs):
-    return torch.cat([x.view(-1) for x in xs])
+    # reshape rather than view: channels_last conv weights, their grads and
+    # momentum buffers are not contiguous
+    return torch.cat([x.reshape(-1) for x in xs])
 
 
 class Architect(object):
@@ -44,6 +60,7 @@ class Architect(object):
         )
 
         self.device = device
+        self.is_multi_gpu = False
 
     def _compute_unrolled_model(self, input, target, eta, network_optimizer):
         logits = self.model(input)
@@ -0,0 +1,173 @@
+# Copyright 2024 Ant Group Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import torch
+
+try:
+    from numba import cuda as numba_cuda
+except ImportError:
+    numba_cuda = None
+
+try:
+    import triton
+    import triton.language as tl
+except ImportError:
+    triton = None
+
+_THREADS_PER_BLOCK = 256
+_MAX_TRITON_BLOCK = 1024
+
+
+if numba_cuda is not None:
+
+    @numba_cuda.jit
+    def _mix_forward_kernel(outs, weights, out):
+        # one thread per output element, reducing over the ops in a register
+        i = numba_cuda.grid(1)
+        if i < out.shape[0]:
+            acc = weights[0] * outs[0, i]
+            for k in range(1, outs.shape[0]):
+                acc += weights[k] * outs[k, i]
+            out[i] = acc
+
+    @numba_cuda.jit
+    def _mix_backward_kernel(grad_out, weights, grad_outs):
+        i = numba_cuda.grid(1)
+        if i < grad_out.shape[0]:
+            g = grad_out[i]
+            for k in range(grad_outs.shape[0]):
+                grad_outs[k, i] = weights[k] * g
+
+
+if triton is not None:
+
+    @triton.jit
+    def _triton_mix_kernel(
+        outs_ptr,
+        weights_ptr,
+        out_ptr,
+        numel,
+        NUM_OPS: tl.constexpr,
+        BLOCK: tl.constexpr,
+    ):
+        # Each program mixes BLOCK output elements. The op outputs are read in
+        # their own dtype (bf16 under autocast) and accumulated in FP32 registers.
+        offsets = tl.program_id(0) * BLOCK + tl.arange(0, BLOCK)
+        mask = offsets < numel
+        acc = tl.zeros([BLOCK], dtype=tl.float32)
+        for k in tl.static_range(NUM_OPS):
+            w = tl.load(weights_ptr + k).to(tl.float32)
+            x = tl.load(outs_ptr + k * numel + offsets, mask=mask, other=0.0)
+            acc += w * x.to(tl.float32)
+        tl.store(out_ptr + offsets, acc.to(out_ptr.dtype.element_ty), mask=mask)
+
+
+def _launch(kernel, numel, *tensors):
+    # run on torch's current stream so the kernel is ordered with the
+    # surrounding torch ops
+    stream = numba_cuda.external_stream(torch.cuda.current_stream().cuda_stream)
+    blocks = (numel + _THREADS_PER_BLOCK - 1) // _THREADS_PER_BLOCK
+    args = [numba_cuda.as_cuda_array(t.detach()) for t in tensors]
+    kernel[blocks, _THREADS_PER_BLOCK, stream](*args)
+
+
+class _NumbaWeightedSum(torch.autograd.Function):
+    # weighted_sum prefers the Triton kernel and the CUDA wheels of PyTorch ship
+    # triton, so this is only used for FP32 inputs on CUDA builds without triton
+    # (e.g. some source builds).
+
+    @staticmethod
+    def forward(ctx, outs, weights):
+        outs = outs.contiguous()
+        weights = weights.contiguous()
+        out = torch.empty(outs.shape[1:], dtype=outs.dtype, device=outs.device)
+        _launch(
+            _mix_forward_kernel,
+            out.numel(),
+            outs.view(outs.size(0), -1),
+            weights,
+            out.view(-1),
+        )
+        ctx.save_for_backward(outs, weights)
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        outs, weights = ctx.saved_tensors
+        grad_out = grad_out.contiguous().view(-1)
+        grad_outs = grad_weights = None
+        if ctx.needs_input_grad[0]:
+            grad_outs = torch.empty_like(outs)
+            _launch(
+                _mix_backward_kernel,
+                grad_out.numel(),
+                grad_out,
+                weights,
+                grad_outs.view(outs.size(0), -1),
+            )
+        if ctx.needs_input_grad[1]:
+            # the gradient of each weight is a full reduction over its op output,
+            # which a single matrix-vector product covers for all ops at once
+            grad_weights = outs.view(outs.size(0), -1).mv(grad_out)
+        return grad_outs, grad_weights
+
+
+class _TritonWeightedSum(torch.autograd.Function):
+
+    @staticmethod
+    def forward(ctx, outs, weights):
+        outs = outs.contiguous()
+        weights = weights.float().contiguous()
+        out = torch.empty(outs.shape[1:], dtype=outs.dtype, device=outs.device)
+        numel = out.numel()
+        block = triton.next_power_of_2(min(numel, _MAX_TRITON_BLOCK))
+        grid = (triton.cdiv(numel, block),)
+        _triton_mix_kernel[grid](
+            outs, weights, out, numel, NUM_OPS=outs.size(0), BLOCK=block
+        )
+        ctx.save_for_backward(outs, weights)
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        outs, weights = ctx.saved_tensors
+        grad_out = grad_out.contiguous().view(-1).float()
+        grad_outs = grad_weights = None
+        if ctx.needs_input_grad[0]:
+            grad_outs = (weights.view(-1, 1) * grad_out).to(outs.dtype)
+            grad_outs = grad_outs.view_as(outs)
+        if ctx.needs_input_grad[1]:
+            grad_weights = outs.view(outs.size(0), -1).float().mv(grad_out)
+        return grad_outs, grad_weights
+
+
+def has_fused_kernel(t):
+    """Whether weighted_sum mixes op outputs like t with a fused CUDA kernel."""
+    # Under torch.compile the plain torch path is traced and fused by Inductor,
+    # while the custom kernels would only cause graph breaks.
+    if not t.is_cuda or torch._dynamo.is_compiling():
+        return False
+    return triton is not None or (numba_cuda is not None and t.dtype == torch.float32)
+
+
+def weighted_sum(outs, weights):
+    """
+    Returns sum_k weights[k] * outs[k] for op outputs stacked along dim 0.
+    The outputs are mixed in a single pass by a Triton kernel (any float dtype,
+    FP32 accumulation) or, for FP32 without triton, by a Numba kernel. Only call
+    it when has_fused_kernel(outs) holds; MixedOp accumulates in place otherwise.
+    """
+    if triton is not None:
+        return _TritonWeightedSum.apply(outs, weights)
+    return _NumbaWeightedSum.apply(outs, weights.to(outs.dtype))
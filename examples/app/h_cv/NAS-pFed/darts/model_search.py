@@ -12,13 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
 from darts.genotypes import PRIMITIVES, Genotype
-from darts.operations import OPS, FactorizedReduce, ReLUConvBN
-from darts.utils import count_parameters_in_MB
+from darts.mix_ops import has_fused_kernel, weighted_sum
+from darts.operations import OPS, DilConv, FactorizedReduce, ReLUConvBN, SepConv
+
+
+@functools.lru_cache(maxsize=None)
+def _bf16_supported():
+    return torch.cuda.is_bf16_supported()
+
+
+def _memory_format(t):
+    if t.dim() == 4 and t.is_contiguous(memory_format=torch.channels_last):
+        return torch.channels_last
+    return torch.contiguous_format
 
 
 class MixedOp(nn.Module):
@@ -26,15 +40,49 @@ class MixedOp(nn.Module):
     def __init__(self, C, stride):
         super(MixedOp, self).__init__()
         self._ops = nn.ModuleList()
+        # SepConv and DilConv all start with the same ReLU on x. It is computed
+        # once per forward and only the remaining layers run per op; the branches
+        # share their modules with self._ops, so parameters are unchanged.
+        self._branches = []
         for primitive in PRIMITIVES:
             op = OPS[primitive](C, stride, False)
             if "pool" in primitive:
                 op = nn.Sequential(op, nn.BatchNorm2d(C, affine=False))
             self._ops.append(op)
+            if isinstance(op, (SepConv, DilConv)):
+                self._branches.append((op.op[1:], True))
+            else:
+                self._branches.append((op, False))
+        self._share_relu = any(shared for _, shared in self._branches)
 
-    def forward(self, x, weights):
+    def forward(self, x, weights, active=None):
         # w is the operation mixing weights. see equation 2 in the original paper.
-        return sum(w * op(x) for w, op in zip(weights, self._ops))
+        # active, if given, holds one bool per op; ops marked False are skipped.
+        x_relu = F.relu(x) if self._share_relu else None
+        if active is not None or not has_fused_kernel(x):
+            # Accumulate in place: every addcmul_ is a single multiply-add kernel
+            # and the op outputs are never stacked into one big temporary.
+            out = None
+            for k, w in enumerate(weights.unbind(0)):
+                if active is not None and not active[k]:
+                    continue
+                branch, shared = self._branches[k]
+                y = branch(x_relu if shared else x)
+                if out is None:
+                    out = y.float() * w
+                else:
+                    out.addcmul_(y.float(), w)
+            return out.to(y.dtype)
+
+        # Every primitive maps x to the same shape, so the outputs are stacked once
+        # and mixed by a single fused kernel instead of a chain of mul/add kernels.
+        outs = [branch(x_relu if shared else x) for branch, shared in self._branches]
+        if _memory_format(outs[0]) == torch.channels_last:
+            # The mix is elementwise, so run it on the NHWC views of the outputs:
+            # the stack stays a plain copy and the result comes back channels_last.
+            stacked = torch.stack([o.permute(0, 2, 3, 1) for o in outs], dim=0)
+            return weighted_sum(stacked, weights).permute(0, 3, 1, 2)
+        return weighted_sum(torch.stack(outs, dim=0), weights)
 
 
 class Cell(nn.Module):
@@ -50,8 +98,11 @@ class Cell(nn.Module):
         else:
             self.preprocess0 = ReLUConvBN(C_prev_prev, C, 1, 1, 0, affine=False)
         self.preprocess1 = ReLUConvBN(C_prev, C, 1, 1, 0, affine=False)
+        assert multiplier <= steps
         self._steps = steps
         self._multiplier = multiplier
+        # edges of step i are self._ops[self._offsets[i] : self._offsets[i] + 2 + i]
+        self._offsets = [i * (i + 3) // 2 for i in range(steps)]
 
         self._ops = nn.ModuleList()
         self._bns = nn.ModuleList()
@@ -61,165 +112,94 @@ class Cell(nn.Module):
                 op = MixedOp(C, stride)
                 self._ops.append(op)
 
-    def forward(self, s0, s1, weights):
+    def forward(self, s0, s1, weights, active=None):
         s0 = self.preprocess0(s0)
         s1 = self.preprocess1(s1)
 
+        # The output is the channel concatenation of the last `multiplier` states.
+        first_out = 2 + self._steps - self._multiplier
+        # one unbind gives the per-edge weight views instead of an index op per edge
+        weights = weights.unbind(0)
         states = [s0, s1]
-        offset = 0
+        # from here on the states list holds the only references to the states
+        del s0, s1
+        last_step = self._steps - 1
         for i in range(self._steps):
-            s = sum(
-                self._ops[offset + j](h, weights[offset + j])
-                for j, h in enumerate(states)
-            )
-            offset += len(states)
+            offset = self._offsets[i]
+            # MixedOp always returns a fresh tensor, so the edges can be summed in place
+            s = None
+            for j, h in enumerate(states):
+                edge_active = None if active is None else active[offset + j]
+                y = self._ops[offset + j](h, weights[offset + j], edge_active)
+                s = y if s is None else s.add_(y)
+                if i == last_step and j < first_out:
+                    # The last step is the final reader of every state, so the
+                    # ones that are not part of the output are released as soon
+                    # as they have been consumed.
+                    states[j] = None
             states.append(s)
-        return torch.cat(states[-self._multiplier :], dim=1)
-
-
-class InnerCell(nn.Module):
-
-    def __init__(
-        self,
-        steps,
-        multiplier,
-        C_prev_prev,
-        C_prev,
-        C,
-        reduction,
-        reduction_prev,
-        weights,
-    ):
-        super(InnerCell, self).__init__()
-        self.reduction = reduction
+        return torch.cat(states[first_out:], dim=1)
+
+
+@functools.lru_cache(maxsize=None)
+def _op_num_params(primitive, C, stride):
+    # Candidate ops are small, so building one on the CPU once per
+    # (primitive, C, stride) is enough to fill the parameter count table.
+    op = OPS[primitive](C, stride, False)
+    return sum(p.numel() for p in op.parameters())
+
+
+def _model_size_in_MB(
+    C,
+    num_classes,
+    layers,
+    choices_normal,
+    choices_reduce,
+    steps,
+    multiplier,
+    stem_multiplier,
+):
+    """
+    Parameter count in MB of the network that keeps only the argmax op of every
+    edge, computed from a per-op parameter table instead of instantiating that
+    network. choices_* hold the argmax op index of every edge into PRIMITIVES, the
+    order of the alpha columns.
+    """
+    C_curr = stem_multiplier * C
+    # stem conv (3 input channels, 3x3, no bias) + affine BatchNorm
+    num_params = 3 * C_curr * 3 * 3 + 2 * C_curr
+
+    C_prev_prev, C_prev, C_curr = C_curr, C_curr, C
+    reduction_prev = False
+    for i in range(layers):
+        if i in [layers // 3, 2 * layers // 3]:
+            C_curr *= 2
+            reduction = True
+            choices = choices_reduce
+        else:
+            reduction = False
+            choices = choices_normal
 
+        # preprocess0/1 are 1x1 convs without bias; their BatchNorms are not affine
         if reduction_prev:
-            self.preprocess0 = FactorizedReduce(C_prev_prev, C, affine=False)
+            num_params += 2 * C_prev_prev * (C_curr // 2)
         else:
-            self.preprocess0 = ReLUConvBN(C_prev_prev, C, 1, 1, 0, affine=False)
-        self.preprocess1 = ReLUConvBN(C_prev, C, 1, 1, 0, affine=False)
-        self._steps = steps
-        self._multiplier = multiplier
+            num_params += C_prev_prev * C_curr
+        num_params += C_prev * C_curr
 
-        self._ops = nn.ModuleList()
-        self._bns = nn.ModuleList()
-        # len(self._ops)=2+3+4+5=14
         offset = 0
-        keys = list(OPS.keys())
-        for i in range(self._steps):
-            for j in range(2 + i):
+        for step in range(steps):
+            for j in range(2 + step):
                 stride = 2 if reduction and j < 2 else 1
-                weight = weights.data[offset + j]
-                choice = keys[weight.argmax()]
-                op = OPS[choice](C, stride, False)
-                if "pool" in choice:
-                    op = nn.Sequential(op, nn.BatchNorm2d(C, affine=False))
-                self._ops.append(op)
-            offset += i + 2
-
-    def forward(self, s0, s1):
-        s0 = self.preprocess0(s0)
-        s1 = self.preprocess1(s1)
-
-        states = [s0, s1]
-        offset = 0
-        for i in range(self._steps):
-            s = sum(self._ops[offset + j](h) for j, h in enumerate(states))
-            offset += len(states)
-            states.append(s)
-
-        return torch.cat(states[-self._multiplier :], dim=1)
-
-
-class ModelForModelSizeMeasure(nn.Module):
-    """
-    This class is used only for calculating the size of the generated model.
-    The choices of opeartions are made using the current alpha value of the DARTS model.
-    The main difference between this model and DARTS model are the following:
-        1. The __init__ takes one more parameter "alphas_normal" and "alphas_reduce"
-        2. The new Cell module is rewriten to contain the functionality of both Cell and MixedOp
-        3. To be more specific, MixedOp is replaced with a fixed choice of operation based on
-            the argmax(alpha_values)
-        4. The new Cell class is redefined as an Inner Class. The name is the same, so please be
-            very careful when you change the code later
-        5.
-
-    """
-
-    def __init__(
-        self,
-        C,
-        num_classes,
-        layers,
-        criterion,
-        alphas_normal,
-        alphas_reduce,
-        steps=4,
-        multiplier=4,
-        stem_multiplier=3,
-    ):
-        super(ModelForModelSizeMeasure, self).__init__()
-        self._C = C
-        self._num_classes = num_classes
-        self._layers = layers
-        self._criterion = criterion
-        self._steps = steps
-        self._multiplier = multiplier
+                choice = PRIMITIVES[choices[offset + j]]
+                num_params += _op_num_params(choice, C_curr, stride)
+            offset += step + 2
 
-        C_curr = stem_multiplier * C  # 3*16
-        self.stem = nn.Sequential(
-            nn.Conv2d(3, C_curr, 3, padding=1, bias=False), nn.BatchNorm2d(C_curr)
-        )
+        reduction_prev = reduction
+        C_prev_prev, C_prev = C_prev, multiplier * C_curr
 
-        C_prev_prev, C_prev, C_curr = C_curr, C_curr, C
-        self.cells = nn.ModuleList()
-        reduction_prev = False
-
-        # for layers = 8, when layer_i = 2, 5, the cell is reduction cell.
-        for i in range(layers):
-            if i in [layers // 3, 2 * layers // 3]:
-                C_curr *= 2
-                reduction = True
-                cell = InnerCell(
-                    steps,
-                    multiplier,
-                    C_prev_prev,
-                    C_prev,
-                    C_curr,
-                    reduction,
-                    reduction_prev,
-                    alphas_reduce,
-                )
-            else:
-                reduction = False
-                cell = InnerCell(
-                    steps,
-                    multiplier,
-                    C_prev_prev,
-                    C_prev,
-                    C_curr,
-                    reduction,
-                    reduction_prev,
-                    alphas_normal,
-                )
-
-            reduction_prev = reduction
-            self.cells += [cell]
-            C_prev_prev, C_prev = C_prev, multiplier * C_curr
-
-        self.global_pooling = nn.AdaptiveAvgPool2d(1)
-        self.classifier = nn.Linear(C_prev, num_classes)
-
-    def forward(self, input_data):
-        s0 = s1 = self.stem(input_data)
-        for i, cell in enumerate(self.cells):
-            if cell.reduction:
-                s0, s1 = s1, cell(s0, s1)
-            else:
-                s0, s1 = s1, cell(s0, s1)
-        out = self.global_pooling(s1)
-        logits = self.classifier(out.view(out.size(0), -1))
-        return logits
+    num_params += C_prev * num_classes + num_classes
+    return num_params / 1e6
 
 
 class Network(nn.Module):
@@ -246,6 +226,16 @@ class Network(nn.Module):
         self._stem_multiplier = stem_multiplier
 
         self.device = device
+        # Ops whose mixing weight is at most skip_eps are not evaluated, except the
+        # argmax op of each edge. Skipping biases the gradients of those ops and
+        # their alphas, so it is disabled by default; set it for evaluation or late
+        # epochs once the softmax is sharp.
+        self.skip_eps = 0.0
+        # Runs the cells under bf16 autocast on CUDA devices that support it. Off
+        # by default: the second-order architect step perturbs the weights by far
+        # less than one bf16 step, so its Hessian-vector product needs FP32.
+        self.use_amp = False
+        self._compiled_forward = None
 
         C_curr = stem_multiplier * C  # 3*16
         self.stem = nn.Sequential(
@@ -280,61 +270,109 @@ class Network(nn.Module):
         self.classifier = nn.Linear(C_prev, num_classes)
 
         self._initialize_alphas()
+        # cudnn convs run natively in NHWC; keeping weights and activations
+        # channels_last end to end avoids layout transposes around every conv.
+        self.to(memory_format=torch.channels_last)
 
     def new(self):
-        model_new = Network(
-            self._C, self._num_classes, self._layers, self._criterion, self.device
-        ).to(self.device)
+        # Build the copy under the device context so its weights are created on
+        # self.device directly instead of on the host and then copied over.
+        with torch.device(self.device):
+            model_new = Network(
+                self._C, self._num_classes, self._layers, self._criterion, self.device
+            ).to(self.device)
         for x, y in zip(model_new.arch_parameters(), self.arch_parameters()):
             x.data.copy_(y.data)
         return model_new
 
+    def enable_compile(self, mode="reduce-overhead"):
+        """
+        Routes forward passes with grad enabled through torch.compile. The first
+        call pays for compilation, so this is meant for the long-lived search model
+        rather than the short-lived copies made by new().
+        """
+        self._compiled_forward = torch.compile(self._forward, mode=mode, dynamic=False)
+
     def forward(self, input):
-        s0 = s1 = self.stem(input)
-        for i, cell in enumerate(self.cells):
-            if cell.reduction:
-                weights = F.softmax(self.alphas_reduce, dim=-1)
-            else:
-                weights = F.softmax(self.alphas_normal, dim=-1)
-            s0, s1 = s1, cell(s0, s1, weights)
-        out = self.global_pooling(s1)
-        logits = self.classifier(out.view(out.size(0), -1))
-        return logits
+        # With use_amp the cells run under bf16 autocast; MixedOp accumulates in FP32.
+        use_amp = self.use_amp and input.is_cuda and _bf16_supported()
+        if self._compiled_forward is not None and torch.is_grad_enabled():
+            return self._compiled_forward(input, use_amp)
+        return self._forward(input, use_amp)
+
+    def _forward(self, input, use_amp):
+        input = input.contiguous(memory_format=torch.channels_last)
+        # alphas are constant during a forward pass, so the softmax is computed
+        # once here instead of once per cell.
+        # The softmax runs outside of autocast, so the mixing weights stay in FP32.
+        weights = F.softmax(self.alphas, dim=-1)
+        weights_normal, weights_reduce = weights
+        active_normal = active_reduce = None
+        if self.skip_eps > 0:
+            # a single device-to-host copy decides which ops every edge evaluates;
+            # the argmax op of every edge always runs, so no edge is left empty
+            top = weights == weights.amax(dim=-1, keepdim=True)
+            active_normal, active_reduce = ((weights > self.skip_eps) | top).tolist()
+        with torch.autocast(device_type="cuda", dtype=torch.bfloat16, enabled=use_amp):
+            s0 = s1 = self.stem(input)
+            for i, cell in enumerate(self.cells):
+                if cell.reduction:
+                    s0, s1 = s1, cell(s0, s1, weights_reduce, active_reduce)
+                else:
+                    s0, s1 = s1, cell(s0, s1, weights_normal, active_normal)
+            out = self.global_pooling(s1)
+            logits = self.classifier(out.view(out.size(0), -1))
+        return logits.float()
 
     def _initialize_alphas(self):
         k = sum(1 for i in range(self._steps) for n in range(2 + i))
         num_ops = len(PRIMITIVES)
 
-        self.alphas_normal = nn.Parameter(1e-3 * torch.randn(k, num_ops))
-        self.alphas_reduce = nn.Parameter(1e-3 * torch.randn(k, num_ops))
-        # self._arch_parameters = [
-        #     self.alphas_normal,
-        #     self.alphas_reduce,
-        # ]
-        self.history_normal = torch.zeros_like(self.alphas_normal)
-        self.history_reduce = torch.zeros_like(self.alphas_reduce)
+        # alphas[0] holds the normal cell alphas and alphas[1] the reduce cell ones,
+        # so that a single softmax covers both.
+        self.alphas = nn.Parameter(
+            torch.randn(2, k, num_ops, device=self.device).mul_(1e-3)
+        )
+        # Buffers follow the model across .to()/.cpu(). They are kept out of the
+        # state_dict so the server's weight averaging never touches the history.
+        self.register_buffer(
+            "history_normal",
+            torch.zeros(k, num_ops, device=self.device),
+            persistent=False,
+        )
+        self.register_buffer(
+            "history_reduce",
+            torch.zeros(k, num_ops, device=self.device),
+            persistent=False,
+        )
 
     def new_arch_parameters(self):
         k = sum(1 for i in range(self._steps) for n in range(2 + i))
         num_ops = len(PRIMITIVES)
 
-        alphas_normal = nn.Parameter(1e-3 * torch.randn(k, num_ops)).to(self.device)
-        alphas_reduce = nn.Parameter(1e-3 * torch.randn(k, num_ops)).to(self.device)
+        alphas = nn.Parameter(torch.randn(2, k, num_ops, device=self.device).mul_(1e-3))
         _arch_parameters = [
-            alphas_normal,
-            alphas_reduce,
+            alphas,
         ]
         return _arch_parameters
 
     def arch_parameters(self):
-        # return self._arch_parameters
-        return [self.alphas_normal, self.alphas_reduce]
+        return [self.alphas]
+
+    @property
+    def alphas_normal(self):
+        return self.alphas[0]
+
+    @property
+    def alphas_reduce(self):
+        return self.alphas[1]
 
     def genotype(self):
         def _isCNNStructure(k_best):
             return k_best >= 4
 
         def _parse(weights):
+            none_idx = PRIMITIVES.index("none")
             gene = []
             n = 2
             start = 0
@@ -342,35 +380,25 @@ class Network(nn.Module):
             for i in range(self._steps):
                 end = start + n
                 W = weights[start:end].copy()
-                edges = sorted(
-                    range(i + 2),
-                    key=lambda x: -max(
-                        W[x][k]
-                        for k in range(len(W[x]))
-                        if k != PRIMITIVES.index("none")
-                    ),
-                )[:2]
+                W[:, none_idx] = -np.inf
+                best_ops = W.argmax(axis=1)
+                best_vals = W[np.arange(n), best_ops]
+                edges = np.argsort(-best_vals, kind="stable")[:2]
                 for j in edges:
-                    k_best = None
-                    for k in range(len(W[j])):
-                        if k != PRIMITIVES.index("none"):
-                            if k_best is None or W[j][k] > W[j][k_best]:
-                                k_best = k
-
+                    k_best = int(best_ops[j])
                     if _isCNNStructure(k_best):
                         cnn_structure_count += 1
-                    gene.append((PRIMITIVES[k_best], j))
+                    gene.append((PRIMITIVES[k_best], int(j)))
                 start = end
                 n += 1
             return gene, cnn_structure_count
 
         with torch.no_grad():
-            gene_normal, cnn_structure_count_normal = _parse(
-                F.softmax(self.alphas_normal, dim=-1).data.cpu().numpy()
-            )
-            gene_reduce, cnn_structure_count_reduce = _parse(
-                F.softmax(self.alphas_reduce, dim=-1).data.cpu().numpy()
+            weights_normal, weights_reduce = (
+                F.softmax(self.alphas, dim=-1).data.cpu().numpy()
             )
+            gene_normal, cnn_structure_count_normal = _parse(weights_normal)
+            gene_reduce, cnn_structure_count_reduce = _parse(weights_reduce)
 
             concat = range(2 + self._steps - self._multiplier, self._steps + 2)
             genotype = Genotype(
@@ -382,21 +410,17 @@ class Network(nn.Module):
         return genotype, cnn_structure_count_normal, cnn_structure_count_reduce
 
     def get_current_model_size(self):
-        model = ModelForModelSizeMeasure(
+        choices_normal, choices_reduce = self.alphas.data.argmax(dim=-1).cpu().tolist()
+        return _model_size_in_MB(
             self._C,
             self._num_classes,
             self._layers,
-            self._criterion,
-            self.alphas_normal,
-            self.alphas_reduce,
+            choices_normal,
+            choices_reduce,
             self._steps,
             self._multiplier,
             self._stem_multiplier,
         )
-        size = count_parameters_in_MB(model)
-        # This need to be further checked with cuda stuff
-        del model
-        return size
 
 
 class EMNIST(nn.Module):
@@ -431,6 +455,16 @@ class EMNIST(nn.Module):
         self._stem_multiplier = stem_multiplier
 
         self.device = device
+        # Ops whose mixing weight is at most skip_eps are not evaluated, except the
+        # argmax op of each edge. Skipping biases the gradients of those ops and
+        # their alphas, so it is disabled by default; set it for evaluation or late
+        # epochs once the softmax is sharp.
+        self.skip_eps = 0.0
+        # Runs the cells under bf16 autocast on CUDA devices that support it. Off
+        # by default: the second-order architect step perturbs the weights by far
+        # less than one bf16 step, so its Hessian-vector product needs FP32.
+        self.use_amp = False
+        self._compiled_forward = None
 
         C_curr = stem_multiplier * C  # 3*16
         self.stem = nn.Sequential(
@@ -467,57 +501,104 @@ class EMNIST(nn.Module):
         self.classifier = nn.Linear(C_prev, num_classes)
 
         self._initialize_alphas()
+        # cudnn convs run natively in NHWC; keeping weights and activations
+        # channels_last end to end avoids layout transposes around every conv.
+        self.to(memory_format=torch.channels_last)
 
     def new(self):
-        model_new = Network(
-            self._C, self._num_classes, self._layers, self._criterion, self.device
-        ).to(self.device)
+        # Build the copy under the device context so its weights are created on
+        # self.device directly instead of on the host and then copied over.
+        with torch.device(self.device):
+            model_new = EMNIST(
+                self._C, self._num_classes, self._layers, self._criterion, self.device
+            ).to(self.device)
         for x, y in zip(model_new.arch_parameters(), self.arch_parameters()):
             x.data.copy_(y.data)
         return model_new
 
+    def enable_compile(self, mode="reduce-overhead"):
+        """
+        Routes forward passes with grad enabled through torch.compile. The first
+        call pays for compilation, so this is meant for the long-lived search model
+        rather than the short-lived copies made by new().
+        """
+        self._compiled_forward = torch.compile(self._forward, mode=mode, dynamic=False)
+
     def forward(self, input):
-        s0 = s1 = self.stem(input)
-        for i, cell in enumerate(self.cells):
-            if cell.reduction:
-                weights = F.softmax(self.alphas_reduce, dim=-1)
-            else:
-                weights = F.softmax(self.alphas_normal, dim=-1)
-            s0, s1 = s1, cell(s0, s1, weights)
-        out = self.global_pooling(s1)
-        logits = self.classifier(out.view(out.size(0), -1))
-        return logits
+        # With use_amp the cells run under bf16 autocast; MixedOp accumulates in FP32.
+        use_amp = self.use_amp and input.is_cuda and _bf16_supported()
+        if self._compiled_forward is not None and torch.is_grad_enabled():
+            return self._compiled_forward(input, use_amp)
+        return self._forward(input, use_amp)
+
+    def _forward(self, input, use_amp):
+        input = input.contiguous(memory_format=torch.channels_last)
+        # alphas are constant during a forward pass, so the softmax is computed
+        # once here instead of once per cell.
+        # The softmax runs outside of autocast, so the mixing weights stay in FP32.
+        weights = F.softmax(self.alphas, dim=-1)
+        weights_normal, weights_reduce = weights
+        active_normal = active_reduce = None
+        if self.skip_eps > 0:
+            # a single device-to-host copy decides which ops every edge evaluates;
+            # the argmax op of every edge always runs, so no edge is left empty
+            top = weights == weights.amax(dim=-1, keepdim=True)
+            active_normal, active_reduce = ((weights > self.skip_eps) | top).tolist()
+        with torch.autocast(device_type="cuda", dtype=torch.bfloat16, enabled=use_amp):
+            s0 = s1 = self.stem(input)
+            for i, cell in enumerate(self.cells):
+                if cell.reduction:
+                    s0, s1 = s1, cell(s0, s1, weights_reduce, active_reduce)
+                else:
+                    s0, s1 = s1, cell(s0, s1, weights_normal, active_normal)
+            out = self.global_pooling(s1)
+            logits = self.classifier(out.view(out.size(0), -1))
+        return logits.float()
 
     def _initialize_alphas(self):
         k = sum(1 for i in range(self._steps) for n in range(2 + i))
         num_ops = len(PRIMITIVES)
 
-        self.alphas_normal = nn.Parameter(1e-3 * torch.randn(k, num_ops))
-        self.alphas_reduce = nn.Parameter(1e-3 * torch.randn(k, num_ops))
-        # self._arch_parameters = [
-        #     self.alphas_normal,
-        #     self.alphas_reduce,
-        # ]
+        # alphas[0] holds the normal cell alphas and alphas[1] the reduce cell ones,
+        # so that a single softmax covers both.
+        self.alphas = nn.Parameter(
+            torch.randn(2, k, num_ops, device=self.device).mul_(1e-3)
+        )
         # 保存历史的权重信息
-        self.history_normal = torch.zeros_like(self.alphas_normal)
-        self.history_reduce = torch.zeros_like(self.alphas_reduce)
+        # Buffers follow the model across .to()/.cpu(). They are kept out of the
+        # state_dict so the server's weight averaging never touches the history.
+        self.register_buffer(
+            "history_normal",
+            torch.zeros(k, num_ops, device=self.device),
+            persistent=False,
+        )
+        self.register_buffer(
+            "history_reduce",
+            torch.zeros(k, num_ops, device=self.device),
+            persistent=False,
+        )
 
     def new_arch_parameters(self):
         k = sum(1 for i in range(self._steps) for n in range(2 + i))
         num_ops = len(PRIMITIVES)
 
         # 初始化normal和reduce的每条边上各个操作的权重
-        alphas_normal = nn.Parameter(1e-3 * torch.randn(k, num_ops)).to(self.device)
-        alphas_reduce = nn.Parameter(1e-3 * torch.randn(k, num_ops)).to(self.device)
+        alphas = nn.Parameter(torch.randn(2, k, num_ops, device=self.device).mul_(1e-3))
         _arch_parameters = [
-            alphas_normal,
-            alphas_reduce,
+            alphas,
         ]
         return _arch_parameters
 
     def arch_parameters(self):
-        # return self._arch_parameters
-        return [self.alphas_normal, self.alphas_reduce]
+        return [self.alphas]
+
+    @property
+    def alphas_normal(self):
+        return self.alphas[0]
+
+    @property
+    def alphas_reduce(self):
+        return self.alphas[1]
 
     def genotype(self):
         # 检查输入边上的操作是否是卷积操作：k_best对应着genotypes.py文件中的PRIMITIVES数组，该数组中索引4及以后的位置对应的是卷积操作
@@ -525,6 +606,7 @@ class EMNIST(nn.Module):
             return k_best >= 4
 
         def _parse(weights):
+            none_idx = PRIMITIVES.index("none")
             gene = []
             n = 2
             start = 0
@@ -535,37 +617,27 @@ class EMNIST(nn.Module):
                 # start表示当前节点所有边的起始索引，end表示终止索引。W仍然是一个二维矩阵，每一行代表该条边每种操作的权重
                 W = weights[start:end].copy()
                 # 先排序出权重值最大的一种操作做为每条边的操作，然后返回权重值最大的两条边作为当前节点本轮搜索的结果
-                edges = sorted(
-                    range(i + 2),
-                    key=lambda x: -max(
-                        W[x][k]
-                        for k in range(len(W[x]))
-                        if k != PRIMITIVES.index("none")
-                    ),
-                )[:2]
+                W[:, none_idx] = -np.inf
+                best_ops = W.argmax(axis=1)
+                best_vals = W[np.arange(n), best_ops]
+                edges = np.argsort(-best_vals, kind="stable")[:2]
                 for j in edges:
-                    k_best = None
-                    for k in range(len(W[j])):
-                        if k != PRIMITIVES.index("none"):
-                            if k_best is None or W[j][k] > W[j][k_best]:
-                                k_best = k
-
+                    k_best = int(best_ops[j])
                     if _isCNNStructure(k_best):
                         cnn_structure_count += 1
                     # PRIMITIVES[k_best]表示该边的操作类型，j表示该边输入节点的索引
-                    gene.append((PRIMITIVES[k_best], j))
+                    gene.append((PRIMITIVES[k_best], int(j)))
                 start = end
                 n += 1
             return gene, cnn_structure_count
 
         with torch.no_grad():
             # 先对行做softmax操作
-            gene_normal, cnn_structure_count_normal = _parse(
-                F.softmax(self.alphas_normal, dim=-1).data.cpu().numpy()
-            )
-            gene_reduce, cnn_structure_count_reduce = _parse(
-                F.softmax(self.alphas_reduce, dim=-1).data.cpu().numpy()
+            weights_normal, weights_reduce = (
+                F.softmax(self.alphas, dim=-1).data.cpu().numpy()
             )
+            gene_normal, cnn_structure_count_normal = _parse(weights_normal)
+            gene_reduce, cnn_structure_count_reduce = _parse(weights_reduce)
 
             concat = range(2 + self._steps - self._multiplier, self._steps + 2)
             genotype = Genotype(
@@ -577,18 +649,14 @@ class EMNIST(nn.Module):
         return genotype, cnn_structure_count_normal, cnn_structure_count_reduce
 
     def get_current_model_size(self):
-        model = ModelForModelSizeMeasure(
+        choices_normal, choices_reduce = self.alphas.data.argmax(dim=-1).cpu().tolist()
+        return _model_size_in_MB(
             self._C,
             self._num_classes,
             self._layers,
-            self._criterion,
-            self.alphas_normal,
-            self.alphas_reduce,
+            choices_normal,
+            choices_reduce,
             self._steps,
             self._multiplier,
             self._stem_multiplier,
         )
-        size = count_parameters_in_MB(model)
-        # This need to be further checked with cuda stuff
-        del model
-        return size
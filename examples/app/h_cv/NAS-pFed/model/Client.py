@@ -76,6 +76,11 @@ class Client(object):
                     self.criterion,
                     self.dev,
                 )
+            model.use_amp = self.args.amp
+            if self.args.compile:
+                # Only this long-lived search model is compiled. The copies that
+                # the architect builds with new() on every step stay eager.
+                model.enable_compile()
         else:
             genotype = genotypes.FedNAS_V1
             logging.info(genotype)
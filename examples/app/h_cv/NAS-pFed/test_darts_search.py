@@ -0,0 +1,188 @@
+# Copyright 2024 Ant Group Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# run from examples/app/h_cv/NAS-pFed:
+#   python -m pytest test_darts_search.py
+
+from types import SimpleNamespace
+
+import pytest
+import torch
+import torch.nn as nn
+
+from darts.architect import Architect
+from darts.genotypes import PRIMITIVES
+from darts.model_search import EMNIST, Network
+from darts.operations import OPS, FactorizedReduce, ReLUConvBN
+
+
+class InnerCell(nn.Module):
+    # Cell that keeps only the argmax op of every edge. Only the parameters
+    # matter here, so there is no forward.
+    def __init__(
+        self, steps, C_prev_prev, C_prev, C, reduction, reduction_prev, weights
+    ):
+        super(InnerCell, self).__init__()
+        if reduction_prev:
+            self.preprocess0 = FactorizedReduce(C_prev_prev, C, affine=False)
+        else:
+            self.preprocess0 = ReLUConvBN(C_prev_prev, C, 1, 1, 0, affine=False)
+        self.preprocess1 = ReLUConvBN(C_prev, C, 1, 1, 0, affine=False)
+
+        self._ops = nn.ModuleList()
+        offset = 0
+        for i in range(steps):
+            for j in range(2 + i):
+                stride = 2 if reduction and j < 2 else 1
+                choice = PRIMITIVES[weights.data[offset + j].argmax()]
+                op = OPS[choice](C, stride, False)
+                if "pool" in choice:
+                    op = nn.Sequential(op, nn.BatchNorm2d(C, affine=False))
+                self._ops.append(op)
+            offset += i + 2
+
+
+class ModelForModelSizeMeasure(nn.Module):
+    # Reference for Network.get_current_model_size: the searched network with
+    # every MixedOp replaced by its argmax op.
+    def __init__(
+        self,
+        C,
+        num_classes,
+        layers,
+        alphas_normal,
+        alphas_reduce,
+        steps=4,
+        multiplier=4,
+        stem_multiplier=3,
+    ):
+        super(ModelForModelSizeMeasure, self).__init__()
+        C_curr = stem_multiplier * C
+        self.stem = nn.Sequential(
+            nn.Conv2d(3, C_curr, 3, padding=1, bias=False), nn.BatchNorm2d(C_curr)
+        )
+
+        C_prev_prev, C_prev, C_curr = C_curr, C_curr, C
+        self.cells = nn.ModuleList()
+        reduction_prev = False
+        for i in range(layers):
+            reduction = i in [layers // 3, 2 * layers // 3]
+            if reduction:
+                C_curr *= 2
+            weights = alphas_reduce if reduction else alphas_normal
+            self.cells += [
+                InnerCell(
+                    steps,
+                    C_prev_prev,
+                    C_prev,
+                    C_curr,
+                    reduction,
+                    reduction_prev,
+                    weights,
+                )
+            ]
+            reduction_prev = reduction
+            C_prev_prev, C_prev = C_prev, multiplier * C_curr
+
+        self.classifier = nn.Linear(C_prev, num_classes)
+
+
+def _search_setup(device="cpu", model_cls=Network):
+    torch.manual_seed(0)
+    criterion = nn.CrossEntropyLoss()
+    model = model_cls(4, 10, 2, criterion, device).to(device)
+    args = SimpleNamespace(
+        momentum=0.9,
+        weight_decay=3e-4,
+        arch_learning_rate=3e-4,
+        arch_weight_decay=1e-3,
+    )
+    architect = Architect(model, criterion, None, args, device)
+    optimizer = torch.optim.SGD(
+        model.parameters(), 0.025, momentum=args.momentum, weight_decay=3e-4
+    )
+    in_channels = model.stem[0].in_channels
+    x = torch.randn(2, in_channels, 8, 8, device=device)
+    y = torch.randint(0, 10, (2,), device=device)
+    return model, architect, optimizer, x, y
+
+
+def test_unrolled_architect_step():
+    model, architect, optimizer, x, y = _search_setup()
+    # one weight step first so the (channels_last) momentum buffers exist
+    optimizer.zero_grad()
+    model._criterion(model(x), y).backward()
+    optimizer.step()
+    assert not model.stem[0].weight.is_contiguous()
+
+    alphas = model.alphas.detach().clone()
+    architect.step(x, y, x, y, 0.025, optimizer, unrolled=True)
+
+    assert model.alphas.grad is not None
+    assert torch.isfinite(model.alphas.grad).all()
+    assert not torch.equal(model.alphas.detach(), alphas)
+
+
+def test_model_size_matches_argmax_model():
+    torch.manual_seed(0)
+    model = Network(4, 10, 5, nn.CrossEntropyLoss(), "cpu")
+    # spread the alphas so that the argmax differs between edges
+    model.alphas.data.normal_()
+    reference = ModelForModelSizeMeasure(
+        4, 10, 5, model.alphas_normal, model.alphas_reduce
+    )
+    num_params = sum(p.numel() for p in reference.parameters())
+    assert model.get_current_model_size() == num_params / 1e6
+
+
+def test_skip_eps_keeps_argmax_op():
+    model, _, _, x, _ = _search_setup()
+    # no op weight exceeds skip_eps, so only the argmax op of each edge runs
+    model.skip_eps = 1.0
+    logits = model(x)
+    assert logits.shape == (2, 10)
+    assert torch.isfinite(logits).all()
+
+
+@pytest.mark.parametrize(
+    "device",
+    [
+        "cpu",
+        pytest.param(
+            "cuda",
+            marks=pytest.mark.skipif(
+                not torch.cuda.is_available(), reason="requires a CUDA device"
+            ),
+        ),
+    ],
+)
+@pytest.mark.parametrize("model_cls", [Network, EMNIST])
+def test_unrolled_model_is_built_on_device(device, model_cls):
+    model, architect, optimizer, x, y = _search_setup(device, model_cls)
+    unrolled = architect._compute_unrolled_model(x, y, 0.025, optimizer)
+
+    assert type(unrolled) is model_cls
+    for p in list(unrolled.parameters()) + list(unrolled.buffers()):
+        assert p.device.type == device
+    # one SGD step without momentum state: w' = w - eta * (dw + wd * w)
+    assert not torch.equal(unrolled.stem[0].weight, model.stem[0].weight)
+    assert unrolled(x).shape == (2, 10)
+
+
+def test_compiled_forward_matches_eager():
+    model, _, _, x, _ = _search_setup()
+    expected = model(x)
+    # "reduce-overhead" adds CUDA graphs, which do not apply on the CPU
+    model.enable_compile(mode="default")
+    torch.testing.assert_close(model(x), expected, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,85 @@
+# Copyright 2024 Ant Group Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# run from examples/app/h_cv/NAS-pFed:
+#   python -m pytest test_mix_ops.py
+
+import pytest
+import torch
+
+from darts import mix_ops
+
+requires_cuda = pytest.mark.skipif(
+    not torch.cuda.is_available(), reason="requires a CUDA device"
+)
+
+
+def _torch_mix(outs, weights):
+    return (outs * weights.view(-1, 1, 1, 1, 1)).sum(0)
+
+
+def _inputs(dtype, num_ops=8, shape=(2, 5, 7, 3), weights_dtype=None):
+    torch.manual_seed(0)
+    outs = torch.randn(num_ops, *shape, device="cuda", dtype=dtype)
+    weights = torch.softmax(torch.randn(num_ops, device="cuda"), 0)
+    weights = weights.to(weights_dtype or dtype)
+    return outs.requires_grad_(), weights.requires_grad_()
+
+
+@requires_cuda
+@pytest.mark.skipif(mix_ops.numba_cuda is None, reason="requires numba")
+def test_numba_weighted_sum_matches_torch():
+    outs, weights = _inputs(torch.float32)
+    out = mix_ops._NumbaWeightedSum.apply(outs, weights)
+    grad = torch.randn_like(out)
+    grads = torch.autograd.grad(out, (outs, weights), grad)
+
+    expected = _torch_mix(outs, weights)
+    expected_grads = torch.autograd.grad(expected, (outs, weights), grad)
+
+    torch.testing.assert_close(out, expected)
+    for g, e in zip(grads, expected_grads):
+        torch.testing.assert_close(g, e)
+
+
+@requires_cuda
+@pytest.mark.skipif(mix_ops.numba_cuda is None, reason="requires numba")
+def test_numba_weighted_sum_gradcheck():
+    outs, weights = _inputs(torch.float64, num_ops=3, shape=(1, 2, 3, 2))
+    assert torch.autograd.gradcheck(mix_ops._NumbaWeightedSum.apply, (outs, weights))
+
+
+@requires_cuda
+@pytest.mark.skipif(mix_ops.triton is None, reason="requires triton")
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+def test_triton_weighted_sum_matches_torch(dtype):
+    # Under autocast the op outputs are bf16 while the mixing weights stay FP32.
+    # 2 * 13 * 11 * 5 elements span two blocks, the second one partial.
+    outs, weights = _inputs(dtype, shape=(2, 13, 11, 5), weights_dtype=torch.float32)
+    out = mix_ops._TritonWeightedSum.apply(outs, weights)
+    grad = torch.randn_like(out)
+    grad_outs, grad_weights = torch.autograd.grad(out, (outs, weights), grad)
+
+    expected = _torch_mix(outs.float(), weights)
+    expected_grad_outs, expected_grad_weights = torch.autograd.grad(
+        expected, (outs, weights), grad.float()
+    )
+
+    assert out.dtype == dtype
+    torch.testing.assert_close(out, expected.to(dtype))
+    torch.testing.assert_close(grad_outs, expected_grad_outs)
+    # full reductions over the op outputs, summed in a different order
+    torch.testing.assert_close(
+        grad_weights, expected_grad_weights, rtol=1e-4, atol=1e-4
+    )